@@ -2,13 +2,22 @@
 # merged_main.py — دمج: phone-session creator + webhook-ready control bot + Pyrogram listener
 
 import os
+import io
 import re
+import sys
 import sqlite3
 import base64
+import struct
+import tempfile
 import logging
 import threading
 import asyncio
 import time
+import random
+import inspect
+import cProfile
+import pstats
+import traceback
 from typing import Optional, List, Tuple, Set
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -21,8 +30,30 @@ from telegram.ext import (
     filters,
 )
 
+import pyrogram.types
 from pyrogram import Client, errors as py_errors, filters as py_filters
+from pyrogram.enums import ChatType
 from pyrogram.handlers import MessageHandler as PyroMessageHandler
+from pyrogram.methods import Methods as PyroMethods
+
+
+def _unwrap_pyrogram_sync():
+    """Undo pyrogram.sync's wrappers so awaited client calls stay on the caller's loop.
+
+    The wrappers forward every call made from a non-main thread to the loop that
+    was current when Pyrogram was imported (the bot's loop once it runs), which
+    moves the listener client - and its internal calls - off the listener thread.
+    Every client call in this file is awaited, so the sync fallback isn't needed.
+    """
+    classes = [PyroMethods] + [c for c in vars(pyrogram.types).values() if inspect.isclass(c)]
+    for cls in classes:
+        for name, attr in list(vars(cls).items()):
+            wrapped = getattr(attr, "__wrapped__", None)
+            if wrapped and (inspect.iscoroutinefunction(wrapped) or inspect.isasyncgenfunction(wrapped)):
+                setattr(cls, name, wrapped)
+
+
+_unwrap_pyrogram_sync()
 
 # ---------- Config ----------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
@@ -42,6 +73,23 @@ os.makedirs(SESSIONS_DIR, exist_ok=True)
 GLOBAL_API_ID = os.getenv("API_ID")
 GLOBAL_API_HASH = os.getenv("API_HASH")
 
+# Listener supervisor (seconds)
+HEALTH_CHECK_INTERVAL = int(os.getenv("HEALTH_CHECK_INTERVAL", 30))
+HEARTBEAT_TIMEOUT = int(os.getenv("HEARTBEAT_TIMEOUT", 15))
+STARTUP_TIMEOUT = int(os.getenv("STARTUP_TIMEOUT", 60))
+RESTART_BACKOFF_BASE = float(os.getenv("RESTART_BACKOFF_BASE", 2))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", 300))
+
+# Listener session storage: "file" (SQLite file in SESSIONS_DIR) or "memory"
+# (session string loaded from the DB and snapshotted back periodically)
+SESSION_STORAGE = os.getenv("SESSION_STORAGE", "file").lower()
+SESSION_SNAPSHOT_INTERVAL = int(os.getenv("SESSION_SNAPSHOT_INTERVAL", 300))
+
+# /profile limits
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 120))
+PROFILE_LAG_INTERVAL = 0.1
+PROFILE_TIMEOUT_MARGIN = 15
+
 # ---------- DB helpers ----------
 def init_db():
     conn = sqlite3.connect(DB_FILE)
@@ -69,10 +117,24 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             filename TEXT,
-            data_b64 TEXT
+            data_b64 TEXT,
+            session_string TEXT
         )
     """)
 
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS keyword_routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            keywords TEXT,
+            target_bot_username TEXT
+        )
+    """)
+
+    cur.execute("PRAGMA table_info(sessions)")
+    if "session_string" not in [r[1] for r in cur.fetchall()]:
+        cur.execute("ALTER TABLE sessions ADD COLUMN session_string TEXT")
+
     conn.commit()
     conn.close()
 
@@ -125,6 +187,23 @@ def get_last_session_row_for_user(user_id: int) -> Optional[Tuple[int, int, str,
     return row
 
 
+def get_session_string_db(session_id: int) -> Optional[str]:
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("SELECT session_string FROM sessions WHERE id = ?", (session_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_session_string_db(session_id: int, session_string: str):
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("UPDATE sessions SET session_string = ? WHERE id = ?", (session_string, session_id))
+    conn.commit()
+    conn.close()
+
+
 def list_sessions_db(user_id: int) -> List[Tuple[int, str]]:
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
@@ -171,6 +250,34 @@ def delete_channel_db(channel_id: int):
     conn.close()
 
 
+def add_keyword_route_db(user_id: int, keywords: List[str], target_bot: str):
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO keyword_routes(user_id, keywords, target_bot_username) VALUES(?,?,?)",
+        (user_id, "\n".join(keywords), target_bot),
+    )
+    conn.commit()
+    conn.close()
+
+
+def list_keyword_routes_db(user_id: int) -> List[Tuple[int, List[str], str]]:
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("SELECT id, keywords, target_bot_username FROM keyword_routes WHERE user_id = ?", (user_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return [(rid, [k for k in (kws or "").split("\n") if k], bot) for rid, kws, bot in rows]
+
+
+def delete_keyword_route_db(route_id: int):
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM keyword_routes WHERE id = ?", (route_id,))
+    conn.commit()
+    conn.close()
+
+
 def get_all_user_ids() -> Set[int]:
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
@@ -189,6 +296,44 @@ def list_users_db() -> List[int]:
     return sorted(list(get_all_user_ids()))
 
 
+# ---------- Session strings ----------
+# same layout as pyrogram.storage.Storage.SESSION_STRING_FORMAT (Pyrogram 2.x)
+SESSION_STRING_FORMAT = ">BI?256sQ?"
+
+
+def session_string_from_file_data(data_b64: str, api_id: int) -> Optional[str]:
+    """Convert a base64 .session (SQLite) file into a Pyrogram session string."""
+    # the file is only opened once per session, in the local temp dir rather than SESSIONS_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "convert.session")
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(data_b64))
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT * FROM sessions LIMIT 1").fetchone()
+        except sqlite3.DatabaseError:
+            logger.exception("invalid session file")
+            return None
+        finally:
+            conn.close()
+    if not row or not row["auth_key"]:
+        return None
+    keys = row.keys()
+    # sessions created by Pyrogram 1.x have no api_id column
+    session_api_id = row["api_id"] if "api_id" in keys and row["api_id"] else api_id
+    packed = struct.pack(
+        SESSION_STRING_FORMAT,
+        row["dc_id"],
+        session_api_id,
+        bool(row["test_mode"]),
+        row["auth_key"],
+        row["user_id"] or 0,
+        bool(row["is_bot"]),
+    )
+    return base64.urlsafe_b64encode(packed).decode().rstrip("=")
+
+
 # ---------- Filtering ----------
 def filter_text_preserve_rules(text: str) -> str:
     text = re.sub(r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]", "", text)
@@ -202,6 +347,73 @@ def filter_text_preserve_rules(text: str) -> str:
     return text
 
 
+# ---------- Keyword routing ----------
+class KeywordMatcher:
+    """Aho-Corasick automaton over all keywords of all routes.
+
+    A single pass over the text returns every route with at least one
+    matching keyword (case-insensitive substring match).
+    """
+
+    def __init__(self, routes: List[Tuple[int, List[str]]]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out: List[Set[int]] = [set()]
+        self.route_ids = set()
+        for route_id, keywords in routes:
+            for kw in keywords:
+                kw = kw.strip().casefold()
+                if kw:
+                    self._add(kw, route_id)
+                    self.route_ids.add(route_id)
+        self._build()
+
+    def _add(self, keyword: str, route_id: int):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            state = nxt
+        self._out[state].add(route_id)
+
+    def _build(self):
+        # BFS from the root's children (which fail to the root), so every
+        # failure link points at an already finished, shallower state
+        queue = list(self._goto[0].values())
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def match(self, text: str) -> Set[int]:
+        found = set()
+        if not self.route_ids:
+            return found
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text.casefold():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+                if len(found) == len(self.route_ids):
+                    break
+        return found
+
+
 # ---------- Pyrogram Listener ----------
 class PyroListener:
     def __init__(self):
@@ -210,7 +422,23 @@ class PyroListener:
         self.client = None
         self.running = False
         self.monitored_channels = set()
+        # (matcher, {route_id: target}) swapped as one snapshot on every change
+        self.keyword_routes = (None, {})
         self.session_user_id = None
+        self.session_id = None
+        self._last_snapshot = None
+
+        # supervisor state
+        self._lock = threading.RLock()
+        self._session_args = None
+        self._supervisor = None
+        self._failures = 0
+        self.started_at = None
+        self.last_heartbeat = None
+        self.last_update = None
+        self.restart_count = 0
+        self.total_downtime = 0.0
+        self.down_since = None
 
     def _write_session_file(self, filename: str, b64data: str) -> str:
         path = os.path.join(SESSIONS_DIR, filename)
@@ -227,92 +455,157 @@ class PyroListener:
             logger.error("API missing for user %s", user_id)
             return False
         api_id, api_hash = api
+        if SESSION_STORAGE == "memory":
+            session_string = get_session_string_db(session_id)
+            if not session_string:
+                session_string = session_string_from_file_data(data_b64, int(api_id))
+                if not session_string:
+                    logger.error("could not convert session %s to a session string", session_id)
+                    return False
+                save_session_string_db(session_id, session_string)
+            name = os.path.splitext(filename)[0]
+            return self.start_with_session_file(name, int(api_id), api_hash, user_id,
+                                                session_string=session_string, session_id=session_id)
         name = self._write_session_file(filename, data_b64)
         return self.start_with_session_file(name, int(api_id), api_hash, user_id)
 
-    def start_with_session_file(self, session_name: str, api_id: int, api_hash: str, user_id: int):
-        self.stop()
-
-        rows = list_channels_db(user_id)
-        mon = set()
-        for r in rows:
-            ch = r[1]
-            if ch and not ch.startswith("@"):
-                ch = "@" + ch
-            mon.add(ch)
-
-        self.monitored_channels = mon
-        self.session_user_id = user_id
+    def start_with_session_file(self, session_name: str, api_id: int, api_hash: str, user_id: int,
+                                session_string: Optional[str] = None, session_id: Optional[int] = None):
+        with self._lock:
+            self.stop()
+
+            rows = list_channels_db(user_id)
+            mon = set()
+            for r in rows:
+                ch = r[1]
+                if ch and not ch.startswith("@"):
+                    ch = "@" + ch
+                mon.add(ch)
+
+            self.monitored_channels = mon
+            self.session_user_id = user_id
+            self.reload_keyword_routes()
+
+            self._session_args = (session_name, api_id, api_hash, user_id, session_string, session_id)
+            self._failures = 0
+            self.down_since = None
+            self._spawn()
+            self._ensure_supervisor()
+        return True
 
+    def _spawn(self):
+        self.started_at = time.time()
         t = threading.Thread(
             target=self._thread_target,
-            args=(session_name, api_id, api_hash, user_id),
+            args=self._session_args,
+            name="pyro-listener",
             daemon=True,
         )
         t.start()
         self.thread = t
-        return True
 
-    def _thread_target(self, session_name, api_id, api_hash, user_id):
+    def _thread_target(self, session_name, api_id, api_hash, user_id, session_string, session_id):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         self.loop = loop
 
-        client = Client(
-            session_name,
-            api_id=api_id,
-            api_hash=api_hash,
-            workdir=SESSIONS_DIR
-        )
+        if session_string:
+            # restarts must pick up the latest snapshot, not the string we started with
+            session_string = get_session_string_db(session_id) or session_string
+            client = Client(
+                session_name,
+                api_id=api_id,
+                api_hash=api_hash,
+                session_string=session_string,
+                in_memory=True
+            )
+        else:
+            client = Client(
+                session_name,
+                api_id=api_id,
+                api_hash=api_hash,
+                workdir=SESSIONS_DIR
+            )
         self.client = client
+        self.session_id = session_id if session_string else None
+        self._last_snapshot = session_string
 
         async def on_message(c, m):
+            self.last_update = time.time()
             try:
                 chat = m.chat
                 if not chat:
                     return
                 username = getattr(chat, "username", None)
-                if not username:
-                    return
-                if not username.startswith("@"):
+                if username and not username.startswith("@"):
                     username = "@" + username
-                if username not in self.monitored_channels:
+                monitored = bool(username) and username in self.monitored_channels
+                # keyword routes see every channel the account receives, not only
+                # the monitored ones, which forward everything to their own target
+                if not monitored and chat.type != ChatType.CHANNEL:
                     return
                 raw = m.text or m.caption
                 if not raw:
                     return
+                matcher, route_targets = self.keyword_routes
+                targets = [route_targets[rid] for rid in matcher.match(raw)] if matcher else []
+                if not monitored and not targets:
+                    return
                 filtered = filter_text_preserve_rules(raw)
                 if filtered.startswith("❌"):
                     return
-                conn = sqlite3.connect(DB_FILE)
-                cur = conn.cursor()
-                cur.execute(
-                    "SELECT target_bot_username FROM channels WHERE user_id=? AND channel_username=? LIMIT 1",
-                    (user_id, username),
-                )
-                row = cur.fetchone()
-                conn.close()
-                if not row:
-                    return
-                target = row[0]
-                if not target.startswith("@"):
-                    target = "@" + target
-                await c.send_message(target, filtered)
+                if monitored:
+                    conn = sqlite3.connect(DB_FILE)
+                    cur = conn.cursor()
+                    cur.execute(
+                        "SELECT target_bot_username FROM channels WHERE user_id=? AND channel_username=? LIMIT 1",
+                        (user_id, username),
+                    )
+                    row = cur.fetchone()
+                    conn.close()
+                    if row:
+                        targets.insert(0, row[0])
+                sent = set()
+                for target in targets:
+                    if not target.startswith("@"):
+                        target = "@" + target
+                    if target in sent:
+                        continue
+                    sent.add(target)
+                    await c.send_message(target, filtered)
             except Exception:
                 logger.exception("error in on_message")
 
         client.add_handler(PyroMessageHandler(on_message, py_filters.all))
 
+        async def snapshot_loop():
+            while True:
+                await asyncio.sleep(SESSION_SNAPSHOT_INTERVAL)
+                await self._snapshot_session(client, session_id)
+
+        snapshot_task = None
         try:
-            loop.run_until_complete(client.start())
+            loop.run_until_complete(self._start_client(client))
             self.running = True
-            loop.run_until_complete(client.idle())
+            self.last_heartbeat = time.time()
+            if session_string:
+                snapshot_task = loop.create_task(snapshot_loop())
+            # pyrogram.idle() installs signal handlers and only works in the main
+            # thread, so keep the loop alive until stop() calls loop.stop()
+            loop.run_forever()
+        except Exception:
+            logger.exception("listener crashed")
         finally:
+            if snapshot_task:
+                snapshot_task.cancel()
             try:
-                loop.run_until_complete(client.stop())
+                loop.run_until_complete(self._stop_client(client))
             except:
                 pass
-            self.running = False
+            loop.close()
+            # a newer client may already be running if we were replaced
+            if self.client is client or self.client is None:
+                self.running = False
 
     def reload_monitored_channels_for_current_session(self):
         if not self.session_user_id:
@@ -325,22 +618,224 @@ class PyroListener:
             mon.add(ch)
         self.monitored_channels = mon
 
-    def stop(self):
-        if self.client and self.loop:
+    def reload_keyword_routes(self):
+        if not self.session_user_id:
+            return
+        routes = list_keyword_routes_db(self.session_user_id)
+        # full rebuild (linear in total keyword length) whenever routes change,
+        # never per message; callers on the bot loop run this in a worker thread
+        matcher = KeywordMatcher([(rid, kws) for rid, kws, _ in routes])
+        self.keyword_routes = (matcher, {rid: bot for rid, _, bot in routes})
+
+    async def _start_client(self, client):
+        await client.start()
+
+    async def _stop_client(self, client):
+        await client.stop()
+
+    async def _ping(self, client):
+        await client.get_me()
+
+    async def _snapshot_session(self, client, session_id):
+        try:
+            session_string = await client.export_session_string()
+        except Exception:
+            logger.exception("session snapshot failed")
+            return
+        if session_string == self._last_snapshot:
+            return
+        # keep the SQLite write off the listener loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, save_session_string_db, session_id, session_string
+        )
+        self._last_snapshot = session_string
+        logger.info("session %s snapshot saved", session_id)
+
+    async def _shutdown_client(self, client, session_id):
+        # the in-memory storage is gone once the client stops, so snapshot first
+        if session_id:
+            await self._snapshot_session(client, session_id)
+        await client.stop()
+
+    def _teardown(self):
+        client, loop, thread = self.client, self.loop, self.thread
+        if client and loop:
             try:
-                fut = asyncio.run_coroutine_threadsafe(self.client.stop(), self.loop)
+                fut = asyncio.run_coroutine_threadsafe(self._shutdown_client(client, self.session_id), loop)
                 fut.result(timeout=10)
             except:
                 pass
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                pass  # loop already closed
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=10)
         self.client = None
         self.loop = None
         self.thread = None
         self.running = False
 
+    def stop(self):
+        with self._lock:
+            # an explicit stop means the supervisor must not bring it back
+            self._session_args = None
+            if self.down_since is not None:
+                self.total_downtime += time.time() - self.down_since
+                self.down_since = None
+            self._teardown()
+
+    # ---------- Supervisor ----------
+    def _ensure_supervisor(self):
+        if self._supervisor and self._supervisor.is_alive():
+            return
+        t = threading.Thread(target=self._supervise, name="listener-supervisor", daemon=True)
+        t.start()
+        self._supervisor = t
+
+    def _heartbeat(self) -> bool:
+        client, loop = self.client, self.loop
+        if not (client and loop):
+            return False
+        fut = None
+        try:
+            fut = asyncio.run_coroutine_threadsafe(self._ping(client), loop)
+            fut.result(timeout=HEARTBEAT_TIMEOUT)
+        except Exception:
+            # don't leave a hung get_me pending on the listener loop
+            if fut:
+                fut.cancel()
+            logger.warning("listener heartbeat failed", exc_info=True)
+            return False
+        self.last_heartbeat = time.time()
+        return True
+
+    def _is_healthy(self) -> bool:
+        if not (self.thread and self.thread.is_alive() and self.running):
+            return False
+        # recent updates prove the connection is alive; skip the get_me round-trip
+        if self.last_update and time.time() - self.last_update < HEALTH_CHECK_INTERVAL:
+            self.last_heartbeat = self.last_update
+            return True
+        return self._heartbeat()
+
+    def _is_starting(self) -> bool:
+        return bool(
+            self.thread and self.thread.is_alive() and not self.running
+            and self.started_at and time.time() - self.started_at < STARTUP_TIMEOUT
+        )
+
+    def _backoff_delay(self) -> float:
+        # exponential backoff with full jitter
+        cap = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * (2 ** (self._failures - 1)))
+        return random.uniform(0, cap)
+
+    def _supervise(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            args = self._session_args
+            if not args or self._is_starting():
+                continue
+
+            healthy = self._is_healthy()
+            with self._lock:
+                # stop() or a new session may have run while we were checking
+                if self._session_args is not args:
+                    continue
+                if healthy:
+                    if self.down_since is not None:
+                        downtime = time.time() - self.down_since
+                        self.total_downtime += downtime
+                        self.down_since = None
+                        logger.info("listener recovered after %.1fs of downtime", downtime)
+                    self._failures = 0
+                    continue
+                if self.down_since is None:
+                    self.down_since = time.time()
+                self._failures += 1
+                delay = self._backoff_delay()
+            logger.warning("listener is down (failure #%s); restarting in %.1fs", self._failures, delay)
+            time.sleep(delay)
+
+            with self._lock:
+                # the session may have been stopped or replaced while we slept
+                if self._session_args is not args:
+                    continue
+                self._teardown()
+                self._spawn()
+                self.restart_count += 1
+            logger.info("listener restarted (restart #%s)", self.restart_count)
+
+    def status(self) -> dict:
+        now = time.time()
+        downtime = self.total_downtime
+        if self.down_since is not None:
+            downtime += now - self.down_since
+        return {
+            "active": self._session_args is not None,
+            "running": self.running,
+            "user_id": self.session_user_id,
+            "restart_count": self.restart_count,
+            "failures": self._failures,
+            "down_for": (now - self.down_since) if self.down_since is not None else 0.0,
+            "total_downtime": downtime,
+            "last_heartbeat": self.last_heartbeat,
+            "last_update": self.last_update,
+        }
+
 
 pyro_listener = PyroListener()
 
 
+# ---------- Profiler ----------
+_profiling = False
+
+
+async def _profile_loop(seconds: float):
+    """Profile the thread running the current event loop for `seconds`.
+
+    Returns (profile, profiled, thread name, max lag, avg lag, task stacks).
+    Must run inside the loop being profiled: cProfile only hooks the thread
+    that enables it.
+    """
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+        profiled = True
+    except ValueError:
+        # Python 3.12+: only one cProfile can be active per process, so
+        # whichever loop enables second gets no profile data
+        profiled = False
+    loop = asyncio.get_running_loop()
+    lags = []
+    try:
+        end = loop.time() + seconds
+        while loop.time() < end:
+            t0 = loop.time()
+            await asyncio.sleep(PROFILE_LAG_INTERVAL)
+            lags.append(max(0.0, loop.time() - t0 - PROFILE_LAG_INTERVAL))
+    finally:
+        if profiled:
+            prof.disable()
+
+    buf = io.StringIO()
+    for task in asyncio.all_tasks(loop):
+        buf.write(f"--- {task.get_name()}: {task.get_coro()!r}\n")
+        task.print_stack(limit=20, file=buf)
+    max_lag = max(lags) if lags else 0.0
+    avg_lag = sum(lags) / len(lags) if lags else 0.0
+    return prof, profiled, threading.current_thread().name, max_lag, avg_lag, buf.getvalue()
+
+
+def _dump_thread_stacks() -> str:
+    names = {t.ident: t.name for t in threading.enumerate()}
+    buf = io.StringIO()
+    for ident, frame in sys._current_frames().items():
+        buf.write(f"--- thread {names.get(ident, '?')} ({ident})\n")
+        buf.write("".join(traceback.format_stack(frame)))
+    return buf.getvalue()
+
+
 # ---------- UI ----------
 def main_menu():
     return InlineKeyboardMarkup([
@@ -349,6 +844,9 @@ def main_menu():
         [InlineKeyboardButton("➕ إضافة قناة", callback_data="add_channel")],
         [InlineKeyboardButton("🗑️ حذف قناة", callback_data="delete_channel")],
         [InlineKeyboardButton("📜 عرض القنوات", callback_data="list_channels")],
+        [InlineKeyboardButton("🔑 إضافة مسار كلمات", callback_data="add_route")],
+        [InlineKeyboardButton("❌ حذف مسار كلمات", callback_data="delete_route")],
+        [InlineKeyboardButton("🗂️ عرض مسارات الكلمات", callback_data="list_routes")],
         [InlineKeyboardButton("🔐 إضافة API", callback_data="add_api")],
         [InlineKeyboardButton("👀 عرض API", callback_data="view_api")],
         [InlineKeyboardButton("🔁 إعادة تشغيل المستمع", callback_data="restart_listener")],
@@ -360,6 +858,124 @@ async def start_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("مرحباً 👋\nاختر من القائمة:", reply_markup=main_menu())
 
 
+def _fmt_ts(ts: Optional[float]) -> str:
+    if not ts:
+        return "—"
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))} (قبل {int(time.time() - ts)} ث)"
+
+
+async def status_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        return
+    st = pyro_listener.status()
+    if not st["active"]:
+        state = "⏹️ متوقف"
+    elif st["running"]:
+        state = "✅ يعمل"
+    else:
+        state = "⚠️ معطل"
+    txt = (
+        f"📊 حالة المستمع: {state}\n"
+        f"👤 المستخدم: {st['user_id'] or '—'}\n"
+        f"🔁 عدد إعادة التشغيل: {st['restart_count']}\n"
+        f"❗ إخفاقات متتالية: {st['failures']}\n"
+        f"⏱️ مدة التوقف الحالية: {int(st['down_for'])} ث\n"
+        f"⏳ إجمالي مدة التوقف: {int(st['total_downtime'])} ث\n"
+        f"💓 آخر نبضة: {_fmt_ts(st['last_heartbeat'])}\n"
+        f"📨 آخر تحديث: {_fmt_ts(st['last_update'])}"
+    )
+    await update.message.reply_text(txt)
+
+
+async def profile_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    global _profiling
+    if update.effective_user.id != ADMIN_ID:
+        return
+    try:
+        seconds = int(ctx.args[0]) if ctx.args else 10
+        top = int(ctx.args[1]) if len(ctx.args) > 1 else 25
+    except ValueError:
+        await update.message.reply_text("❌ الاستخدام: /profile [ثوان] [عدد الدوال]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    top = max(1, min(top, 100))
+    if _profiling:
+        await update.message.reply_text("⏳ يوجد تحليل قيد التشغيل.")
+        return
+
+    _profiling = True
+    try:
+        await update.message.reply_text(f"⏱️ جارٍ التحليل لمدة {seconds} ثانية…")
+        summary = []
+        report = io.StringIO()
+        listener_job = None
+        listener_loop = pyro_listener.loop
+        if pyro_listener.running and listener_loop:
+            coro = _profile_loop(seconds)
+            try:
+                listener_job = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, listener_loop))
+            except RuntimeError as e:
+                # the listener loop was closed by a restart in the meantime
+                coro.close()
+                summary.append(f"listener loop: profiling failed: {e!r}")
+                report.write(f"===== {summary[-1]}\n\n")
+        jobs = {"bot": _profile_loop(seconds)}
+        if listener_job:
+            jobs["listener"] = listener_job
+        # a listener restart closes its loop and would leave that future pending forever
+        timeout = seconds + PROFILE_TIMEOUT_MARGIN
+        results = await asyncio.gather(
+            *(asyncio.wait_for(job, timeout) for job in jobs.values()), return_exceptions=True
+        )
+        thread_stacks = _dump_thread_stacks()
+
+        stats = None
+        for name, res in zip(jobs, results):
+            if isinstance(res, BaseException):
+                summary.append(f"{name} loop: profiling failed: {res!r}")
+                report.write(f"===== {summary[-1]}\n\n")
+                continue
+            prof, profiled, thread_name, max_lag, avg_lag, task_stacks = res
+            summary.append(
+                f"{name} loop (thread {thread_name}): lag max {max_lag * 1000:.1f} ms, avg {avg_lag * 1000:.1f} ms"
+            )
+            report.write(f"===== {summary[-1]}\n{task_stacks}\n")
+            if not profiled:
+                summary.append(f"{name} loop: no cProfile data (another profiler active)")
+                report.write(f"===== {summary[-1]}\n\n")
+            else:
+                if stats is None:
+                    stats = pstats.Stats(prof, stream=io.StringIO())
+                else:
+                    stats.add(prof)
+        report.write("===== threads\n" + thread_stacks)
+
+        ts = time.strftime("%Y%m%d_%H%M%S")
+        with tempfile.TemporaryDirectory() as tmp:
+            if stats:
+                top_buf = io.StringIO()
+                stats.stream = top_buf
+                stats.sort_stats("tottime").print_stats(top)
+                # skip pstats' header lines, keep the table
+                table = top_buf.getvalue()
+                header = table.find("   ncalls")
+                summary.append("\n" + (table[header:] if header != -1 else table))
+                report.write("\n===== profile (tottime)\n" + table)
+                prof_path = os.path.join(tmp, f"profile_{ts}.prof")
+                stats.dump_stats(prof_path)
+                with open(prof_path, "rb") as f:
+                    await update.message.reply_document(f, filename=f"profile_{ts}.prof")
+            await update.message.reply_document(
+                io.BytesIO(report.getvalue().encode()), filename=f"stacks_{ts}.txt"
+            )
+        await update.message.reply_text("\n".join(summary)[:4000])
+    except Exception as e:
+        logger.exception("profile error")
+        await update.message.reply_text(f"❌ فشل التحليل:\n{e}")
+    finally:
+        _profiling = False
+
+
 async def pressed_button(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -409,6 +1025,41 @@ async def pressed_button(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         pyro_listener.reload_monitored_channels_for_current_session()
         await q.edit_message_text("🚮 تم حذف القناة.")
 
+    elif q.data == "add_route":
+        await q.edit_message_text(
+            "🔑 أرسل البوت ثم الكلمات مفصولة بفواصل أو أسطر:\n@bot كلمة1, كلمة2, كلمة3\n\n"
+            "ℹ️ يطبق المسار على كل القنوات التي يستقبلها الحساب، ولا يلزم إضافتها كقنوات."
+        )
+        ctx.user_data["awaiting"] = "add_route"
+
+    elif q.data == "list_routes":
+        routes = list_keyword_routes_db(q.from_user.id)
+        if not routes:
+            await q.edit_message_text("لا توجد مسارات.")
+        else:
+            txt = "🗂️ مسارات الكلمات:\n\n"
+            for rid, kws, bot in routes:
+                shown = "، ".join(kws[:10]) + (" …" if len(kws) > 10 else "")
+                txt += f"🆔 {rid}\nبوت: {bot}\nكلمات ({len(kws)}): {shown}\n\n"
+            await q.edit_message_text(txt[:4000])
+
+    elif q.data == "delete_route":
+        routes = list_keyword_routes_db(q.from_user.id)
+        if not routes:
+            await q.edit_message_text("لا توجد مسارات.")
+            return
+        buttons = [
+            [InlineKeyboardButton(f"{rid} - {bot} ({len(kws)})", callback_data=f"delroute:{rid}")]
+            for rid, kws, bot in routes
+        ]
+        await q.edit_message_text("اختر مساراً للحذف:", reply_markup=InlineKeyboardMarkup(buttons))
+
+    elif q.data.startswith("delroute:"):
+        rid = int(q.data.split(":")[1])
+        delete_keyword_route_db(rid)
+        await asyncio.to_thread(pyro_listener.reload_keyword_routes)
+        await q.edit_message_text("🚮 تم حذف المسار.")
+
     elif q.data == "view_api":
         api = get_api(q.from_user.id)
         if not api:
@@ -421,7 +1072,7 @@ async def pressed_button(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if not row:
             await q.edit_message_text("لا توجد جلسة.")
             return
-        ok = pyro_listener.start_with_session_row(row)
+        ok = await asyncio.to_thread(pyro_listener.start_with_session_row, row)
         if ok:
             await q.edit_message_text("🔁 تم إعادة تشغيل المستمع.")
         else:
@@ -445,7 +1096,7 @@ async def text_message(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         # start the listener with this newly uploaded session (the most recent for this user)
         row = get_last_session_row_for_user(user)
         if row:
-            ok = pyro_listener.start_with_session_row(row)
+            ok = await asyncio.to_thread(pyro_listener.start_with_session_row, row)
             if ok:
                 await update.message.reply_text("تم تشغيل الجلسة ✔️", reply_markup=main_menu())
             else:
@@ -544,7 +1195,7 @@ async def text_message(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                         # if user didn't save API earlier, save now using tmp api used
                         if not api:
                             save_api(user, str(api_id_int), api_hash)
-                        ok = pyro_listener.start_with_session_row(row)
+                        ok = await asyncio.to_thread(pyro_listener.start_with_session_row, row)
                         if ok:
                             await update.message.reply_text("🎉 تم تسجيل الدخول ورفع الجلسة ✅\n💾 تم تشغيل المستمع.", reply_markup=main_menu())
                         else:
@@ -608,7 +1259,7 @@ async def text_message(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                         api_record = get_api(user)
                         if not api_record and user_api:
                             save_api(user, str(user_api[0]), user_api[1])
-                        ok = pyro_listener.start_with_session_row(row)
+                        ok = await asyncio.to_thread(pyro_listener.start_with_session_row, row)
                         if ok:
                             await update.message.reply_text("🎉 تسجيل الدخول ناجح!\n💾 تم إنشاء وتفعيل الجلسة.", reply_markup=main_menu())
                         else:
@@ -650,6 +1301,22 @@ async def text_message(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         ctx.user_data["awaiting"] = None
         return
 
+    # ---------- Add keyword route ----------
+    if awaiting == "add_route":
+        parts = (update.message.text or "").split(None, 1)
+        keywords = []
+        # first token must be the target bot's username
+        if len(parts) == 2 and re.fullmatch(r"@?[A-Za-z]\w{3,31}", parts[0], re.ASCII):
+            keywords = [k.strip() for k in re.split(r"[,،\n]", parts[1]) if k.strip()]
+        if not keywords:
+            await update.message.reply_text("❌ أرسل: @bot كلمة1, كلمة2")
+            return
+        add_keyword_route_db(user, keywords, parts[0])
+        await asyncio.to_thread(pyro_listener.reload_keyword_routes)
+        await update.message.reply_text(f"تمت إضافة المسار ✔️ ({len(keywords)} كلمة)", reply_markup=main_menu())
+        ctx.user_data["awaiting"] = None
+        return
+
     # Fallback: show menu
     await update.message.reply_text("اختر من القائمة:", reply_markup=main_menu())
 
@@ -666,6 +1333,9 @@ def main():
     application = Application.builder().token(BOT_TOKEN).build()
 
     application.add_handler(CommandHandler("start", start_cmd))
+    application.add_handler(CommandHandler("status", status_cmd))
+    # non-blocking so other updates keep flowing (and get profiled) meanwhile
+    application.add_handler(CommandHandler("profile", profile_cmd, block=False))
     application.add_handler(CallbackQueryHandler(pressed_button))
     application.add_handler(MessageHandler(filters.ALL, text_message))
 
@@ -687,6 +1357,9 @@ def main():
     else:
         application.run_polling()
 
+    # flush the in-memory session back to the DB before exiting
+    pyro_listener.stop()
+
 
 if __name__ == "__main__":
     main()